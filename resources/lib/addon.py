@@ -22,18 +22,26 @@ import os
 import re
 
 try:
+    from typing import Any
     from typing import Dict
+    from typing import Iterable
+    from typing import List
     from typing import Optional
     from typing import Text
+    from typing import Tuple
 except ImportError:
     pass
 
 try:
     from urllib.parse import parse_qsl
     from urllib.parse import quote
+    from urllib.parse import unquote_plus
+    from urllib.parse import urlencode
 except ImportError:
     from urlparse import parse_qsl
     from urllib import quote
+    from urllib import unquote_plus
+    from urllib import urlencode
 
 from inputstreamhelper import Helper  # pylint: disable=import-error
 import xbmc  # pylint: disable=import-error
@@ -45,7 +53,6 @@ import xbmcplugin  # pylint: disable=import-error
 from resources.lib.api import ArteTV
 from resources.lib.api import ParsedItem
 import resources.lib.kodilogging
-from resources.lib.utils import update_url_params
 
 
 resources.lib.kodilogging.config()
@@ -57,39 +64,176 @@ _KODI_VERSION = int(xbmc.getInfoLabel("System.BuildVersion").split(".")[0])
 _ADDON = Addon()
 _ADDON_DIR = xbmc.translatePath(_ADDON.getAddonInfo("path"))
 _ADDON_MEDIA_DIR = os.path.join(_ADDON_DIR, "resources", "media")
-_ADDON_FANART = Addon().getAddonInfo("fanart")
+_ADDON_FANART = _ADDON.getAddonInfo("fanart")
+_CACHE_DIR = os.path.join(
+    xbmc.translatePath("special://temp/"), _ADDON.getAddonInfo("id")
+)
+
+_ICON_CATEGORIES = os.path.join(_ADDON_MEDIA_DIR, "categories.png")
+_ICON_LAST_CHANCE = os.path.join(_ADDON_MEDIA_DIR, "last-chance.png")
+_ICON_LIVE_TV = os.path.join(_ADDON_MEDIA_DIR, "live-tv.png")
+_ICON_MOST_RECENT = os.path.join(_ADDON_MEDIA_DIR, "most-recent.png")
+_ICON_SEARCH = os.path.join(_ADDON_MEDIA_DIR, "search.png")
+_ICON_TRENDING = os.path.join(_ADDON_MEDIA_DIR, "trending.png")
+_ICON_TV_SHOWS = os.path.join(_ADDON_MEDIA_DIR, "tv-shows.png")
+
+_LOCALIZE_RE = re.compile(r"\$LOCALIZE\[(\d+)\]")
+
+_LOCALIZED_STRINGS = {}  # type: Dict[int, Text]
+
+
+def _localized_string(string_id):
+    # type: (int) -> Text
+
+    # Cache strings to avoid calling the Kodi API for each lookup
+    if string_id not in _LOCALIZED_STRINGS:
+        _LOCALIZED_STRINGS[string_id] = _ADDON.getLocalizedString(string_id)
+
+    return _LOCALIZED_STRINGS[string_id]
+
+
+_DEFAULT_MENUS = {}  # type: Dict[Text, Tuple[ParsedItem, ...]]
+
+
+def _default_menu(language):
+    # type: (Text) -> Tuple[ParsedItem, ...]
+
+    # Main menu items only depend on the language
+    if language in _DEFAULT_MENUS:
+        return _DEFAULT_MENUS[language]
+
+    items = []  # type: List[ParsedItem]
+
+    # Live is only available in German and French
+    if language in ["de", "fr"]:
+        items.append(
+            ParsedItem(
+                _localized_string(30001),
+                {"mode": "watch", "id": "LIVE"},
+                # Don't mark live streams as read once played
+                {"playcount": 0},
+                {"icon": _ICON_LIVE_TV},
+                {"isPlayable": "true"},
+            )
+        )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30002),
+            {"mode": "collection", "path": "CATEGORIES"},
+            {},
+            {"icon": _ICON_CATEGORIES},
+            {"isPlayable": "false"},
+        )
+    )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30003),
+            {"mode": "collection", "path": "MAGAZINES", "level": 0},
+            {},
+            {"icon": _ICON_TV_SHOWS},
+            {"isPlayable": "false"},
+        )
+    )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30004),
+            {"mode": "collection", "path": "MOST_VIEWED", "level": 0},
+            {},
+            {"icon": _ICON_TRENDING},
+            {"isPlayable": "false"},
+        )
+    )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30005),
+            {"mode": "collection", "path": "MOST_RECENT", "level": 0},
+            {},
+            {"icon": _ICON_MOST_RECENT},
+            {"isPlayable": "false"},
+        )
+    )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30006),
+            {"mode": "collection", "path": "LAST_CHANCE", "level": 0},
+            {},
+            {"icon": _ICON_LAST_CHANCE},
+            {"isPlayable": "false"},
+        )
+    )
+
+    items.append(
+        ParsedItem(
+            _localized_string(30007),
+            {"mode": "search"},
+            {},
+            {"icon": _ICON_SEARCH},
+            {"isPlayable": "false"},
+        )
+    )
+
+    _DEFAULT_MENUS[language] = tuple(items)
+
+    return _DEFAULT_MENUS[language]
 
 
 # pylint: disable=too-few-public-methods
 class ArteTVAddon:
-    _ADDON = Addon()
-    _ADDON_ID = "plugin.video.artetv"
-    _ADDON_DIR = xbmc.translatePath(_ADDON.getAddonInfo("path"))
-    _ADDON_MEDIA_DIR = os.path.join(_ADDON_DIR, "resources", "media")
-    _ADDON_FANART = Addon().getAddonInfo("fanart")
-
     def __init__(self, base_url, handle, params):
         # type: (Text, int, Text) -> None
 
-        self._base_url = base_url
+        # Plugin URLs have no query string by themselves
+        self._base_url_prefix = base_url + "?"
         self._handle = handle
         self._params = self._params_to_dict(params)
 
         self._language = self._addon_language()
-        self._api = ArteTV(self._language)
+        self._api = ArteTV(self._language, _CACHE_DIR)
 
     @staticmethod
     def _params_to_dict(params):
         # type: (Optional[Text]) -> Dict[Text, Text]
 
+        if not params:
+            return {}
+
         # Parameter string starts with a '?'
-        return dict(parse_qsl(params[1:])) if params else {}
+        query = params[1:]
+
+        # Only the addon builds these URLs: leave uncommon syntaxes to the
+        # standard parser
+        if ";" in query:
+            return dict(parse_qsl(query))
+
+        result = {}  # type: Dict[Text, Text]
+        for param in query.split("&"):
+            key, _, value = param.partition("=")
+            # Ignore blank values, like parse_qsl() does
+            if not value:
+                continue
+
+            if "%" in value or "+" in value:
+                value = unquote_plus(value)
 
-    @classmethod
-    def _addon_language(cls):
+            result[key] = value
+
+        return result
+
+    def _plugin_url(self, params):
+        # type: (Dict[Text, Any]) -> Text
+
+        return self._base_url_prefix + urlencode(params)
+
+    @staticmethod
+    def _addon_language():
         # type: () -> Text
 
-        language = cls._ADDON.getSetting("language")
+        language = _ADDON.getSetting("language")
 
         if not language:
             language = xbmc.getLanguage(xbmc.ISO_639_1)
@@ -103,40 +247,32 @@ class ArteTVAddon:
     def _localize(self, label):
         # type: (Text) -> Text
 
-        return re.sub(
-            r"\$LOCALIZE\[(\d+)\]",
-            lambda m: self._ADDON.getLocalizedString(int(m.group(1))),
-            label,
+        # Most labels don't need to be localized
+        if "$LOCALIZE[" not in label:
+            return label
+
+        return _LOCALIZE_RE.sub(
+            lambda m: _localized_string(int(m.group(1))), label
         )
 
     def _add_video_context_menu(self, listitem, video_id):
         # type: (ListItem, Text) -> None
 
-        streams = self._api.get_video_streams(video_id)
-
-        # Don't display alternate streams if there is only one or less
-        if len(streams) <= 1:
-            return
-
+        # Alternate stream versions are only fetched once the user selects
+        # this entry, so that no API call is made while listing items
         listitem.addContextMenuItems(
             [
                 (
-                    _ADDON.getLocalizedString(30203).format(v.label),
-                    "XBMC.PlayMedia({})".format(
-                        update_url_params(
-                            self._base_url,
-                            mode="watch",
-                            id=video_id,
-                            version=k,
-                        )
+                    _localized_string(30204),
+                    "RunPlugin({})".format(
+                        self._plugin_url({"mode": "versions", "id": video_id})
                     ),
                 )
-                for k, v in self._api.get_video_streams(str(video_id)).items()
             ]
         )
 
-    def _add_listitem(self, parsed_item):
-        # type: (ParsedItem) -> None
+    def _build_listitem(self, parsed_item):
+        # type: (ParsedItem) -> Tuple[Text, ListItem, bool]
 
         is_folder = parsed_item.url.get("mode") == "collection"
 
@@ -144,14 +280,19 @@ class ArteTVAddon:
         listitem = ListItem(
             label=self._localize(parsed_item.label), offscreen=True
         )
-        if not parsed_item.info.get("plot"):
-            parsed_item.info["plot"] = listitem.getLabel()
+        # Parsed items may be shared between calls: don't alter them
+        info = parsed_item.info
+        if not info.get("plot"):
+            info = dict(info, plot=listitem.getLabel())
 
-        listitem.setInfo("video", parsed_item.info)
+        listitem.setInfo("video", info)
 
         # Set fallback fanart
-        parsed_item.art.setdefault("fanart", self._ADDON_FANART)
-        listitem.setArt(parsed_item.art)
+        art = parsed_item.art
+        if "fanart" not in art:
+            art = dict(art, fanart=_ADDON_FANART)
+
+        listitem.setArt(art)
 
         # Add context menu for alternate stream versions
         if parsed_item.url.get("mode") == "watch":
@@ -160,13 +301,19 @@ class ArteTVAddon:
         for key, value in list(parsed_item.properties.items()):
             listitem.setProperty(key, value)
 
-        xbmcplugin.addDirectoryItem(
-            self._handle,
-            update_url_params(self._base_url, **parsed_item.url),
+        return (
+            self._plugin_url(parsed_item.url),
             listitem,
-            isFolder=is_folder,
+            is_folder,
         )
 
+    def _add_listitems(self, parsed_items):
+        # type: (Iterable[ParsedItem]) -> None
+
+        # Add all items at once, to avoid a Kodi API call per item
+        items = [self._build_listitem(i) for i in parsed_items]
+        xbmcplugin.addDirectoryItems(self._handle, items, len(items))
+
     def _mode_collection(self, path):
         # type: (Text) -> None
 
@@ -179,8 +326,7 @@ class ArteTVAddon:
             except ValueError:
                 pass
 
-        for item in self._api.get_collection(path, level):
-            self._add_listitem(item)
+        self._add_listitems(self._api.get_collection(path, level))
 
     def _mode_watch(self, video_id, version=None):
         # type: (Text, Optional[Text]) -> None
@@ -223,90 +369,52 @@ class ArteTVAddon:
 
         xbmcplugin.setResolvedUrl(self._handle, True, listitem)
 
-    def _mode_search(self):
-        # type: () -> None
-
-        search = Dialog().input(self._ADDON.getLocalizedString(30005))
+    def _mode_versions(self, video_id):
+        # type: (Text) -> None
 
-        self._mode_collection(
-            "data/SEARCH_LISTING/?query={}".format(quote(search, safe=""))
-        )
+        streams = self._api.get_video_streams(video_id)
+        if not streams:
+            _LOGGER.error("No stream available for video %s", video_id)
+            return
 
-    def _mode_default(self):
-        # type: () -> None
+        versions = list(streams.keys())
 
-        # Live is only available in German and French
-        if self._language in ["de", "fr"]:
-            self._add_listitem(
-                ParsedItem(
-                    _ADDON.getLocalizedString(30001),
-                    {"mode": "watch", "id": "LIVE"},
-                    # Don't mark live streams as read once played
-                    {"playcount": 0},
-                    {"icon": os.path.join(_ADDON_MEDIA_DIR, "live-tv.png")},
-                    {"isPlayable": "true"},
-                )
+        # Don't ask for a version if there is only one
+        index = 0
+        if len(versions) > 1:
+            label = _localized_string(30203)
+            index = Dialog().select(
+                _localized_string(30204),
+                [label.format(s.label) for s in streams.values()],
             )
+            if index < 0:
+                return
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30002),
-                {"mode": "collection", "path": "CATEGORIES"},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "categories.png")},
-                {"isPlayable": "false"},
+        xbmc.executebuiltin(
+            "PlayMedia({})".format(
+                self._plugin_url(
+                    {
+                        "mode": "watch",
+                        "id": video_id,
+                        "version": versions[index],
+                    }
+                )
             )
         )
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30003),
-                {"mode": "collection", "path": "MAGAZINES", "level": 0},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "tv-shows.png")},
-                {"isPlayable": "false"},
-            )
-        )
+    def _mode_search(self):
+        # type: () -> None
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30004),
-                {"mode": "collection", "path": "MOST_VIEWED", "level": 0},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "trending.png")},
-                {"isPlayable": "false"},
-            )
-        )
+        search = Dialog().input(_localized_string(30005))
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30005),
-                {"mode": "collection", "path": "MOST_RECENT", "level": 0},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "most-recent.png")},
-                {"isPlayable": "false"},
-            )
+        self._mode_collection(
+            "data/SEARCH_LISTING/?query={}".format(quote(search, safe=""))
         )
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30006),
-                {"mode": "collection", "path": "LAST_CHANCE", "level": 0},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "last-chance.png")},
-                {"isPlayable": "false"},
-            )
-        )
+    def _mode_default(self):
+        # type: () -> None
 
-        self._add_listitem(
-            ParsedItem(
-                _ADDON.getLocalizedString(30007),
-                {"mode": "search"},
-                {},
-                {"icon": os.path.join(_ADDON_MEDIA_DIR, "search.png")},
-                {"isPlayable": "false"},
-            )
-        )
+        self._add_listitems(_default_menu(self._language))
 
     def run(self):
         # type: () -> None
@@ -315,6 +423,11 @@ class ArteTVAddon:
         _LOGGER.debug("Addon params = %s", self._params)
         succeeded = True
 
+        # Called from a context menu: there is no directory to fill
+        if mode == "versions" and self._params.get("id"):
+            self._mode_versions(self._params["id"])
+            return
+
         try:
             if mode == "collection" and self._params.get("path"):
                 self._mode_collection(self._params["path"])
@@ -17,15 +17,22 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 from __future__ import unicode_literals
-from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import json
 import logging
+import os
 from os.path import dirname
 from os.path import join
+import sys
+from tempfile import mkstemp
+import threading
+import time
 
 try:
     from typing import Any
     from typing import Dict
-    from typing import Generator
+    from typing import List
     from typing import NamedTuple
     from typing import Optional
     from typing import Text
@@ -58,20 +65,57 @@ except ImportError:
 
     Stream = namedtuple("StreamVersion", ["label", "url"])  # type: ignore
 
-from dateutil.parser import isoparse
 from requests import Response
 from requests import Session
 from requests.exceptions import HTTPError
 
+# Dictionaries preserve insertion order since Python 3.7
+if sys.version_info >= (3, 7):
+    _ordered_dict = dict  # pylint: disable=invalid-name
+else:
+    from collections import OrderedDict as _ordered_dict  # type: ignore
+
+# Use a faster JSON parser when available
+try:
+    from orjson import loads as json_loads  # pylint: disable=import-error
+except ImportError:
+    from json import loads as json_loads
+
+# Use a faster ISO 8601 date parser when available
+try:
+    # pylint: disable=import-error
+    from ciso8601 import parse_datetime as isoparse
+except ImportError:
+
+    def isoparse(value):  # type: ignore
+        # type: (Text) -> datetime
+
+        # Python < 3.11 doesn't support the "Z" UTC designator
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+
+        try:
+            return datetime.fromisoformat(value)
+        except (AttributeError, ValueError):
+            # Python < 3.7, or unsupported format: only keep the date and
+            # time parts, as time zones are ignored by Kodi
+            return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
 
 _LOGGER = logging.getLogger(__name__)
 
-_IMAGE_TYPE_MAPPING = {
-    "banner": "banner",
-    "landscape": "fanart",
-    "portrait": "poster",
-    "square": "thumb",
-}
+# ARTE image types, with their Kodi equivalent
+_IMAGE_TYPE_MAPPING = (
+    ("banner", "banner"),
+    ("landscape", "fanart"),
+    ("portrait", "poster"),
+    ("square", "thumb"),
+)
+
+# Maximum age of cached app API responses, in seconds
+_CACHE_TTL = 300
+# Age after which cache files are deleted, in seconds
+_CACHE_MAX_AGE = 86400
 
 _MEDIA_DIR = join(dirname(__file__), "..", "media")
 _NEXT_PAGE_ICON = join(_MEDIA_DIR, "next-page.png")
@@ -81,6 +125,16 @@ class ArteTVException(Exception):
     pass
 
 
+# pylint: disable=too-few-public-methods
+class _PendingQuery:
+    def __init__(self):
+        # type: () -> None
+
+        self.done = threading.Event()
+        self.result = {}  # type: Dict[Text, Any]
+        self.error = None  # type: Optional[Exception]
+
+
 class ArteTV:
     LANGUAGES = ["de", "en", "es", "fr", "it", "pl"]
 
@@ -89,17 +143,25 @@ class ArteTV:
         "MWZmZjk5NjE1ODgxM2E0MTI2NzY4MzQ5MTZkOWVkYTA1M2U4YjM3NDM2MjEwMDllODRhM"
         "jIzZjQwNjBiNGYxYw"
     )
+    _API_V3_HEADERS = {"Authorization": "Bearer {}".format(_API_V3_BEARER)}
 
     _API_V2_URL = "https://api.arte.tv/api/player/v2/config"
     _API_V2_BEARER = (
         "ZWU0ZWU0NDlmNTNkODcwNWZhNTYzOTc5MjExZTc4NjE4NzExYjE1OTM3YjFhOTQxMTJhN"
         "WJlNzYxNmM3MTdjYQ"
     )
+    _API_V2_HEADERS = {"Authorization": "Bearer {}".format(_API_V2_BEARER)}
 
-    def __init__(self, language):
-        # type: (Text) -> None
+    # App API queries in progress, shared by all instances
+    _PENDING_QUERIES = {}  # type: Dict[Text, _PendingQuery]
+    _PENDING_QUERIES_LOCK = threading.Lock()
+
+    def __init__(self, language, cache_dir=None):
+        # type: (Text, Optional[Text]) -> None
 
         self._language = language
+        self._cache_dir = cache_dir
+        self._cache_pruned = False
         self._api_v3_url = "{}/{}/app".format(self._API_V3_BASE_URL, language)
         self._session = Session()
         self._session.headers.update(
@@ -122,59 +184,193 @@ class ArteTV:
             response.raise_for_status()
         except HTTPError as ex:
             try:
-                raise ArteTVException(ex, ex.response.json().get("error"))
+                raise ArteTVException(
+                    ex, json_loads(ex.response.content).get("error")
+                )
             except ValueError:
                 raise ex
 
-    def _query_api(self, url, bearer, params=None):
-        # type: (Text, Text, Optional[Dict[Text, Text]]) -> Dict[Text, Any]
+    def _query_api(
+        self,
+        url,  # type: Text
+        headers,  # type: Dict[Text, Text]
+        params=None,  # type: Optional[Dict[Text, Text]]
+    ):
+        # type: (...) -> Dict[Text, Any]
 
-        return self._session.get(
-            url,
-            headers={"Authorization": "Bearer {}".format(bearer)},
-            params=params,
-        ).json()
+        return json_loads(
+            self._session.get(url, headers=headers, params=params).content
+        )
 
     def _query_app_api(self, path):
         # type: (Text) -> Dict[Text, Any]
 
-        # path = update_url_params(
-        #     path, imageFormats="banner,landscape,portrait,square"
-        # )
+        url = "{}/{}".format(self._api_v3_url, path.strip("/"))
+
+        with self._PENDING_QUERIES_LOCK:
+            pending = self._PENDING_QUERIES.get(url)
+            if pending:
+                is_owner = False
+            else:
+                is_owner = True
+                pending = self._PENDING_QUERIES[url] = _PendingQuery()
+
+        # Share the result of an identical query already in progress
+        if not is_owner:
+            pending.done.wait()
+            if pending.error:
+                raise pending.error
+            return pending.result
+
+        try:
+            if self._cache_dir:
+                result = self._query_cached_api(url, self._API_V3_HEADERS)
+            else:
+                result = self._query_api(url, self._API_V3_HEADERS)
+            pending.result = result
+        except Exception as ex:  # pylint: disable=broad-except
+            pending.error = ex
+            raise
+        finally:
+            with self._PENDING_QUERIES_LOCK:
+                del self._PENDING_QUERIES[url]
+            pending.done.set()
+
+        return result
+
+    @staticmethod
+    def _read_cache(cache_file):
+        # type: (Text) -> Optional[Dict[Text, Any]]
+
+        try:
+            with open(cache_file, "rb") as cache:
+                entry = json_loads(cache.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Treat unexpected content as a cache miss
+        if (
+            not isinstance(entry, dict)
+            or not isinstance(entry.get("timestamp"), (int, float))
+            or not isinstance(entry.get("data"), dict)
+        ):
+            return None
+
+        return entry
+
+    def _prune_cache(self):
+        # type: () -> None
 
-        return self._session.get(
-            "{}/{}".format(self._api_v3_url, path.strip("/")),
-            headers={"Authorization": "Bearer {}".format(self._API_V3_BEARER)},
-        ).json()
+        # Only prune once per instance, i.e. once per addon invocation
+        if self._cache_pruned:
+            return
+        self._cache_pruned = True
+
+        min_mtime = time.time() - _CACHE_MAX_AGE
+
+        for name in os.listdir(self._cache_dir):  # type: ignore
+            cache_file = join(self._cache_dir, name)  # type: ignore
+            try:
+                if os.path.getmtime(cache_file) < min_mtime:
+                    os.remove(cache_file)
+            except OSError:
+                # File removed concurrently
+                pass
+
+    def _write_cache(self, cache_file, etag, data):
+        # type: (Text, Optional[Text], Dict[Text, Any]) -> None
+
+        entry = {"timestamp": time.time(), "etag": etag, "data": data}
+        temp_file = None  # type: Optional[Text]
+
+        try:
+            if not os.path.isdir(self._cache_dir):  # type: ignore
+                os.makedirs(self._cache_dir)  # type: ignore
+
+            self._prune_cache()
+
+            # Write to a temporary file first, so that concurrent readers
+            # never get a partial entry
+            handle, temp_file = mkstemp(dir=self._cache_dir)
+            with os.fdopen(handle, "w") as cache:
+                json.dump(entry, cache)
+            if hasattr(os, "replace"):
+                os.replace(temp_file, cache_file)  # type: ignore
+            else:
+                # Python 2: os.rename() fails on Windows if the target file
+                # exists
+                try:
+                    os.remove(cache_file)
+                except OSError:
+                    pass
+                os.rename(temp_file, cache_file)
+        except (IOError, OSError) as ex:
+            _LOGGER.warning("Unable to cache %s: %s", cache_file, ex)
+
+            if temp_file and os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+
+    def _query_cached_api(self, url, headers):
+        # type: (Text, Dict[Text, Text]) -> Dict[Text, Any]
+
+        cache_file = join(
+            self._cache_dir,  # type: ignore
+            "{}.json".format(hashlib.sha256(url.encode("utf-8")).hexdigest()),
+        )
+
+        entry = self._read_cache(cache_file)
+        if entry and time.time() - entry["timestamp"] < _CACHE_TTL:
+            return entry["data"]
+
+        # Revalidate expired entries
+        if entry and entry.get("etag"):
+            headers = dict(headers, **{"If-None-Match": entry["etag"]})
+
+        response = self._session.get(url, headers=headers)
+
+        etag = response.headers.get("ETag")
+        if response.status_code == 304 and entry:
+            data = entry["data"]
+            etag = etag or entry.get("etag")
+        else:
+            data = json_loads(response.content)
+            # Only cache successful responses
+            if response.status_code != 200:
+                return data
+
+        self._write_cache(cache_file, etag, data)
+
+        return data
 
     def _query_player_api(self, video_id):
         return self._query_api(
             "{}/{}/{}".format(self._API_V2_URL, self._language, video_id),
-            self._API_V2_BEARER,
+            self._API_V2_HEADERS,
         )
 
     @staticmethod
     def _parse_item_art(item):
         # type: (Item) -> Art
 
-        art = {}  # type: Art
-
-        for image_type, image in list((item.get("images") or {}).items()):
-            kodi_image_type = _IMAGE_TYPE_MAPPING.get(image_type)
+        images = item.get("images")
+        if not images:
+            return {}
 
-            if not kodi_image_type:
-                raise Exception("TYPE INCONNU")
+        art = {}  # type: Art
 
+        # Only look up image types with a Kodi equivalent
+        for image_type, kodi_image_type in _IMAGE_TYPE_MAPPING:
+            image = images.get(image_type)
             if not image or not image.get("resolutions"):
                 continue
 
-            # Sort images by quality
-            image_urls = sorted(
+            # Keep the image with the best quality
+            art[kodi_image_type] = max(
                 image["resolutions"], key=lambda i: i.get("w") or 0
-            )
-
-            image_url = image_urls[-1].get("url")
-            art.setdefault(kodi_image_type, image_url)
+            ).get("url")
 
         art.setdefault("icon", art.get("fanart"))
 
@@ -214,48 +410,56 @@ class ArteTV:
     ):
         # type: (...) -> Optional[ParsedItem]
 
-        info = {}  # type: Dict[Text, Any]
-        art = ArteTV._parse_item_art(item)
-        properties = {}  # type: Dict[Text, Text]
+        item_get = item.get
 
-        title = item.get("title") or ""
+        title = item_get("title") or ""
         if not title:
             _LOGGER.warning("No title in item %s in path %s", item, url)
 
-        result = ParsedItem(title, url, info, art, properties)
+        art = ArteTV._parse_item_art(item)
 
-        short_description = item.get("shortDescription")
-        info["plot"] = (
-            item.get("fullDescription")
-            or item.get("description")
+        short_description = item_get("shortDescription")
+        plot = (
+            item_get("fullDescription")
+            or item_get("description")
             or short_description
         )
 
         # No need to parse more item metadata for collections
         if url["mode"] == "collection":
-            properties["isPlayable"] = "false"
-            return result
+            return ParsedItem(
+                title, url, {"plot": plot}, art, {"isPlayable": "false"}
+            )
 
-        if item.get("ageRating"):
-            info["mpaa"] = item["ageRating"]
+        info = {
+            "plot": plot,
+            "duration": item_get("duration"),
+            "tagline": item_get("subtitle") or item_get("teaserText"),
+            "mediatype": "movie",
+        }  # type: Dict[Text, Any]
 
-        if short_description and short_description != info["plot"]:
-            info["plotoutline"] = short_description
+        age_rating = item_get("ageRating")
+        if age_rating:
+            info["mpaa"] = age_rating
 
-        info["duration"] = item.get("duration")
-        info["tagline"] = item.get("subtitle") or item.get("teaserText")
+        if short_description and short_description != plot:
+            info["plotoutline"] = short_description
 
-        date_added = (item.get("availability") or {}).get("start")
+        date_added = (item_get("availability") or {}).get("start")
         if date_added:
-            info["dateadded"] = isoparse(date_added).strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-
-        info["mediatype"] = "movie"
-
-        properties["isPlayable"] = "true"
+            try:
+                info["dateadded"] = isoparse(date_added).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+            except ValueError:
+                _LOGGER.warning(
+                    "Invalid date %s in item %s in path %s",
+                    date_added,
+                    item,
+                    url,
+                )
 
-        return result
+        return ParsedItem(title, url, info, art, {"isPlayable": "true"})
 
     def _get_program_item(self, program_id):
         # type: (str) -> Optional[Item]
@@ -275,7 +479,9 @@ class ArteTV:
         return next(iter(program_content.get("data") or []), None)
 
     def get_collection(self, path, level):
-        # type: (Text, Optional[int]) -> Generator[ParsedItem, None, None]
+        # type: (Text, Optional[int]) -> List[ParsedItem]
+
+        result = []  # type: List[ParsedItem]
 
         data = self._query_app_api(path)
         collection = data.get("zones") or data.get("data") or []
@@ -311,29 +517,34 @@ class ArteTV:
 
             parsed_item = self._parse_item(item, url)
             if parsed_item:
-                yield parsed_item
+                result.append(parsed_item)
 
         # Add "next page" item
         if data.get("nextPage"):
-            yield ParsedItem(
-                "$LOCALIZE[30201]",
-                {
-                    "mode": "collection",
-                    "path": data["nextPage"].replace(self._api_v3_url, ""),
-                },
-                {"plot": ""},
-                {"icon": _NEXT_PAGE_ICON},
-                {"SpecialSort": "bottom"},
+            result.append(
+                ParsedItem(
+                    "$LOCALIZE[30201]",
+                    {
+                        "mode": "collection",
+                        "path": data["nextPage"].replace(self._api_v3_url, ""),
+                    },
+                    {"plot": ""},
+                    {"icon": _NEXT_PAGE_ICON},
+                    {"SpecialSort": "bottom"},
+                )
             )
 
+        return result
+
     def get_video_streams(self, video_id):
         # type: (Text) -> Dict[Text, Stream]
 
+        # Streams are only requested at playback time, or when the user
+        # selects a version from the context menu, never while listing items
         data = self._query_player_api(video_id).get("data") or {}
 
         streams = (data.get("attributes") or {}).get("streams") or []
-        print(streams)
-        result = OrderedDict()  # type: Dict[Text, Stream]
+        result = _ordered_dict()  # type: Dict[Text, Stream]
 
         for stream in streams:
             if not stream.get("url") or not stream.get("versions"):
@@ -18,40 +18,47 @@
 
 from __future__ import unicode_literals
 import logging
+import threading
 
 try:
+    from typing import Any
+    from typing import Dict
     from typing import List
     from typing import Optional
+    from typing import Set
     from typing import Text
     from typing import Tuple
 
     from urllib.error import HTTPError
+
+    Task = Tuple[Text, Text, Optional[int]]
 except ImportError:
     from urllib2 import HTTPError
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # type: ignore
+
 from unittest import TestCase
 
 from resources.lib.api import ArteTV
 from resources.lib.api import ArteTVException
 
 
+_WORKER_COUNT = 16
+
+
 class WalkthroughTest(TestCase):
     def _scan_collection(
         self,
         api,  # type: ArteTV
         path,  # type: Text
         level,  # type: Optional[int]
-        _buffer,  # type: List[Tuple[Text, Optional[int]]]
     ):
-        # type: (...) -> None
-
-        if not _buffer:
-            _buffer = []
-
-        if (path, level) in _buffer:
-            return
+        # type: (...) -> List[Tuple[Text, Optional[int]]]
 
-        _buffer.append((path, level))
+        children = []  # type: List[Tuple[Text, Optional[int]]]
 
         for item in api.get_collection(path, level):
             logging.debug("item = %s", item)
@@ -73,29 +80,90 @@ class WalkthroughTest(TestCase):
                 else:
                     new_level = None
 
-                try:
-                    self._scan_collection(
-                        api,
-                        new_path,  # type: ignore
-                        new_level,
-                        _buffer,
-                    )
-                except ArteTVException as ex:
-                    if ex.args and isinstance(ex.args[0], HTTPError):
-                        logging.error(ex)
+                children.append((new_path, new_level))  # type: ignore
+
+        return children
+
+    def _scan_worker(
+        self,
+        tasks,  # type: Queue
+        visited,  # type: Set[Task]
+        lock,  # type: Any
+        errors,  # type: List[Exception]
+    ):
+        # type: (...) -> None
+
+        # requests sessions must not be shared between threads: use one API
+        # client per language in each worker
+        apis = {}  # type: Dict[Text, ArteTV]
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                tasks.task_done()
+                return
+
+            language, path, level = task
+            try:
+                api = apis.get(language)
+                if not api:
+                    api = apis[language] = ArteTV(language)
+
+                for new_path, new_level in self._scan_collection(
+                    api, path, level
+                ):
+                    new_task = (language, new_path, new_level)
+                    with lock:
+                        if new_task in visited:
+                            continue
+                        visited.add(new_task)
+
+                    tasks.put(new_task)
+            except ArteTVException as ex:
+                if ex.args and isinstance(ex.args[0], HTTPError):
+                    logging.error(ex)
+            except Exception as ex:  # pylint: disable=broad-except
+                # Report failures to the main thread
+                errors.append(ex)
+            finally:
+                tasks.task_done()
 
     def test_walthrough(self):
         # type: () -> None
 
-        _buffer = []  # type: List[Tuple[Text, Optional[int]]]
+        tasks = Queue()  # type: Queue
+        visited = set()  # type: Set[Task]
+        lock = threading.Lock()
+        errors = []  # type: List[Exception]
 
         for language in ArteTV.LANGUAGES:
-            logging.info("Language = %s", language)
-
-            api = ArteTV(language)
-
-            self._scan_collection(api, "CATEGORIES", None, _buffer)
-            self._scan_collection(api, "MAGAZINES", 0, _buffer)
-            self._scan_collection(api, "MOST_VIEWED", 0, _buffer)
-            self._scan_collection(api, "MOST_RECENT", 0, _buffer)
-            self._scan_collection(api, "LAST_CHANCE", 0, _buffer)
+            for path, level in [
+                ("CATEGORIES", None),
+                ("MAGAZINES", 0),
+                ("MOST_VIEWED", 0),
+                ("MOST_RECENT", 0),
+                ("LAST_CHANCE", 0),
+            ]:
+                task = (language, path, level)  # type: Task
+                visited.add(task)
+                tasks.put(task)
+
+        workers = [
+            threading.Thread(
+                target=self._scan_worker, args=(tasks, visited, lock, errors)
+            )
+            for _ in range(_WORKER_COUNT)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        tasks.join()
+
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            raise errors[0]